@@ -1,20 +1,25 @@
+import math
 import os
 import uuid
 import shutil
 import subprocess
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional
 
-import aiofiles
+import librosa
+import numpy as np
 import soundfile as sf
+from cachetools import TTLCache
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, field_validator
+from scipy.signal import resample_poly
 
-from beattogrid.analyze import analyze_audio
+from beattogrid.analyze import analyze_audio, BeatAnalysis
 from beattogrid.grid import build_corrected_grid, GridSettings
-from beattogrid.warp import warp_to_grid, WarpOptions
+from beattogrid.warp import warp_file_to_grid, WarpOptions
 
 APP_ROOT = Path(__file__).parent.resolve()
 STORAGE = APP_ROOT / "storage"
@@ -38,8 +43,16 @@ app = FastAPI(title="BeatToGrid")
 # serve frontend
 app.mount("/web", StaticFiles(directory=str(APP_ROOT / "web"), html=True), name="web")
 
-# naive in-memory job store (ok voor lokaal)
-JOBS: Dict[str, Dict[str, Any]] = {}
+# bounded in-memory job store (ok voor lokaal): entries expire after an hour.
+# Only paths/status live here; the analysis itself is kept on disk (analysis.npz).
+# TTLCache is not thread-safe, so JOBS is only touched from async endpoints (event loop thread).
+JOBS: TTLCache = TTLCache(maxsize=1024, ttl=3600)
+
+
+@app.on_event("startup")
+def _warmup():
+    # beat_track is numba-compiled: pay the JIT cost at startup instead of on the first upload
+    librosa.beat.beat_track(y=np.zeros(22050, dtype=np.float32), sr=22050)
 
 
 def _ffmpeg_to_wav(in_path: Path, out_path: Path):
@@ -62,11 +75,84 @@ def _ffmpeg_to_wav(in_path: Path, out_path: Path):
 
 
 
+def _save_upload(file: UploadFile, out_path: Path):
+    # UploadFile.file is already a SpooledTemporaryFile; big blocking copy beats async 1 MiB chunks
+    with open(out_path, "wb") as f:
+        shutil.copyfileobj(file.file, f, length=8 * 1024 * 1024)
+
+
+# containers we conform in-process (no decoder needed); everything else goes through ffmpeg
+UNCOMPRESSED_FORMATS = ("WAV", "WAVEX", "AIFF")
+
+
+def _probe(path: Path):
+    # header probe only; None if soundfile can't open it
+    try:
+        return sf.info(str(path))
+    except Exception:
+        return None
+
+
+def _is_pcm_wav(info) -> bool:
+    return (
+        info is not None
+        and info.format in ("WAV", "WAVEX")
+        and info.subtype.startswith("PCM")
+        and info.samplerate in (44100, 48000)
+        and info.channels in (1, 2)
+    )
+
+
+def _save_analysis(path: Path, analysis: BeatAnalysis):
+    np.savez_compressed(
+        path,
+        sample_rate=analysis.sample_rate,
+        beats=analysis.beats,
+        bpm_estimate=analysis.bpm_estimate,
+    )
+
+
+def _load_analysis(path: Path) -> BeatAnalysis:
+    with np.load(path) as z:
+        return BeatAnalysis(
+            sample_rate=int(z["sample_rate"]),
+            beats=z["beats"],
+            downbeats=None,
+            bpm_estimate=float(z["bpm_estimate"]),
+        )
+
+
+def _analyze_and_save(wav_path: Path, analysis_path: Path) -> BeatAnalysis:
+    # one threadpool hop: the npz write is blocking I/O too
+    analysis = analyze_audio(str(wav_path))
+    _save_analysis(analysis_path, analysis)
+    return analysis
+
+
+def _conform_wav(in_path: Path, out_path: Path):
+    # in-process equivalent of _ffmpeg_to_wav for uncompressed input: no fork/exec, polyphase resample
+    y, sr = sf.read(str(in_path), dtype="float32", always_2d=True)
+    if y.shape[1] == 1:
+        y = np.repeat(y, 2, axis=1)  # like -ac 2
+    if sr not in (44100, 48000):
+        g = math.gcd(44100, sr)
+        y = resample_poly(y, 44100 // g, sr // g, axis=0)
+        sr = 44100
+    sf.write(str(out_path), y, sr, subtype="PCM_16")
+
+
 def _ensure_wav(path: Path) -> Path:
-    if path.suffix.lower() == ".wav":
+    info = _probe(path)
+    if _is_pcm_wav(info):
         return path
     wav_path = path.with_suffix(".wav")
-    _ffmpeg_to_wav(path, wav_path)
+    if wav_path == path:
+        wav_path = path.with_name(f"{path.stem}_pcm.wav")
+    # >2 channels go to ffmpeg too: its -ac 2 downmix follows the channel layout
+    if info is not None and info.format in UNCOMPRESSED_FORMATS and info.channels <= 2:
+        _conform_wav(path, wav_path)
+    else:
+        _ffmpeg_to_wav(path, wav_path)
     return wav_path
 
 
@@ -75,6 +161,12 @@ class AnalyzeResponse(BaseModel):
     bpm_estimate: float
     beats: list[float]
 
+    @field_validator("beats", mode="before")
+    @classmethod
+    def _beats_to_list(cls, v):
+        # analysis keeps beats as a numpy array; convert once, here at the HTTP boundary
+        return v.tolist() if isinstance(v, np.ndarray) else v
+
 
 class ProcessRequest(BaseModel):
     job_id: str
@@ -97,23 +189,20 @@ async def upload(file: UploadFile = File(...)):
     job_dir.mkdir(parents=True, exist_ok=True)
 
     in_path = job_dir / file.filename
-    async with aiofiles.open(in_path, "wb") as f:
-        while True:
-            chunk = await file.read(1024 * 1024)
-            if not chunk:
-                break
-            await f.write(chunk)
+    await run_in_threadpool(_save_upload, file, in_path)
 
-    JOBS[job_id] = {"status": "uploaded", "input": str(in_path)}
+    job = JOBS[job_id] = {"status": "uploaded", "input": str(in_path)}
 
     try:
-        wav_path = _ensure_wav(in_path)
-        JOBS[job_id]["wav"] = str(wav_path)
-        JOBS[job_id]["status"] = "analyzing"
+        # ffmpeg + beat tracking are blocking/CPU-heavy: keep them off the event loop
+        wav_path = await run_in_threadpool(_ensure_wav, in_path)
+        job["wav"] = str(wav_path)
+        job["status"] = "analyzing"
 
-        analysis = analyze_audio(str(wav_path))
-        JOBS[job_id]["analysis"] = analysis
-        JOBS[job_id]["status"] = "ready"
+        analysis_path = job_dir / "analysis.npz"
+        analysis = await run_in_threadpool(_analyze_and_save, wav_path, analysis_path)
+        job["analysis"] = str(analysis_path)
+        job["status"] = "ready"
 
         return AnalyzeResponse(
             job_id=job_id,
@@ -121,13 +210,13 @@ async def upload(file: UploadFile = File(...)):
             beats=analysis.beats,
         )
     except Exception as e:
-        JOBS[job_id]["status"] = "error"
-        JOBS[job_id]["error"] = str(e)
+        job["status"] = "error"
+        job["error"] = str(e)
         raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.get("/api/status/{job_id}")
-def status(job_id: str):
+async def status(job_id: str):
     job = JOBS.get(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Unknown job_id")
@@ -135,47 +224,54 @@ def status(job_id: str):
 
 
 @app.post("/api/process", response_model=ProcessResponse)
-def process(req: ProcessRequest):
+async def process(req: ProcessRequest):
     job = JOBS.get(req.job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Unknown job_id")
     if job.get("status") not in ("ready", "processed"):
         raise HTTPException(status_code=400, detail=f"Job not ready (status={job.get('status')})")
 
-    analysis = job["analysis"]
-    wav_path = Path(job["wav"])
-
+    # claim the job before the first await: a concurrent call must see "processing" and get a 400,
+    # not render the same output (and scratch file) alongside this one
+    prev_status = job["status"]
     job["status"] = "processing"
 
-    # choose target bpm
-    target_bpm = float(req.target_bpm) if req.target_bpm else round(float(analysis.bpm_estimate))
-
-    # find nearest beat index to clicked anchor_time
-    beats = analysis.beats
-    anchor_idx = min(range(len(beats)), key=lambda i: abs(beats[i] - req.anchor_time))
+    try:
+        analysis = await run_in_threadpool(_load_analysis, Path(job["analysis"]))
+        wav_path = Path(job["wav"])
 
-    corrected = build_corrected_grid(
-        analysis,
-        GridSettings(target_bpm=target_bpm, strength=float(req.strength), anchor_beat_index=int(anchor_idx))
-    )
+        # choose target bpm
+        target_bpm = float(req.target_bpm) if req.target_bpm else round(float(analysis.bpm_estimate))
 
-    # load audio for warping (stereo)
-    y, sr = sf.read(str(wav_path), dtype="float32", always_2d=False)
+        # find nearest beat index to clicked anchor_time (beats are sorted: binary search)
+        beats = analysis.beats
+        pos = int(np.searchsorted(beats, req.anchor_time))
+        lo = max(0, pos - 1)
+        anchor_idx = lo + int(np.argmin(np.abs(beats[lo:pos + 1] - req.anchor_time)))
 
-    out = warp_to_grid(
-        y=y,
-        sr=sr,
-        src_beats=analysis.beats,
-        dst_beats=corrected,
-        options=WarpOptions(engine=req.engine, crossfade_ms=int(req.crossfade_ms), headroom_db=1.0)
-    )
-
-    out_name = f"{wav_path.stem}_straight_{target_bpm:.2f}.wav"
-    out_path = OUTPUTS / req.job_id
-    out_path.mkdir(parents=True, exist_ok=True)
-    final_path = out_path / out_name
+        corrected = build_corrected_grid(
+            analysis,
+            GridSettings(target_bpm=target_bpm, strength=float(req.strength), anchor_beat_index=int(anchor_idx))
+        )
 
-    sf.write(str(final_path), out, sr, subtype="PCM_16")
+        out_name = f"{wav_path.stem}_straight_{target_bpm:.2f}.wav"
+        out_path = OUTPUTS / req.job_id
+        out_path.mkdir(parents=True, exist_ok=True)
+        final_path = out_path / out_name
+
+        # warping can take tens of seconds: run it in a worker thread so other requests keep flowing.
+        # Segments are read from / written to disk as they go, so long tracks don't sit in RAM.
+        await run_in_threadpool(
+            warp_file_to_grid,
+            str(wav_path),
+            str(final_path),
+            analysis.beats,
+            corrected,
+            WarpOptions(engine=req.engine, crossfade_ms=int(req.crossfade_ms), headroom_db=1.0),
+        )
+    except Exception:
+        job["status"] = prev_status
+        raise
 
     job["status"] = "processed"
     job["output"] = str(final_path)
@@ -184,7 +280,7 @@ def process(req: ProcessRequest):
 
 
 @app.get("/api/download/{job_id}")
-def download(job_id: str):
+async def download(job_id: str):
     job = JOBS.get(job_id)
     if not job or job.get("status") != "processed":
         raise HTTPException(status_code=404, detail="No processed output for this job.")
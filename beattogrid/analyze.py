@@ -1,18 +1,23 @@
 import librosa
+import numpy as np
+import soundfile as sf
 from dataclasses import dataclass
 from typing import List, Optional
 
 @dataclass
 class BeatAnalysis:
     sample_rate: int
-    beats: List[float]
+    beats: np.ndarray            # float64 seconden; lijst pas aan de HTTP-grens
     downbeats: Optional[List[float]]
     bpm_estimate: float
 
 
 def analyze_audio(path: str) -> BeatAnalysis:
     # Load mono for analysis (audio warping gebeurt later stereo-safe)
-    y, sr = librosa.load(path, sr=None, mono=True)
+    # Input is altijd al WAV (zie _ensure_wav), dus soundfile volstaat; geen audioread fallback nodig
+    y, sr = sf.read(path, dtype="float32", always_2d=False)
+    if y.ndim == 2:
+        y = y.mean(axis=1)
 
     tempo, beat_frames = librosa.beat.beat_track(y=y, sr=sr, units="frames")
     beat_times = librosa.frames_to_time(beat_frames, sr=sr)
@@ -22,7 +27,7 @@ def analyze_audio(path: str) -> BeatAnalysis:
 
     return BeatAnalysis(
         sample_rate=sr,
-        beats=beat_times.tolist(),
+        beats=beat_times,
         downbeats=None,  # later uitbreidbaar
         bpm_estimate=float(tempo),
     )
@@ -8,13 +8,19 @@ class GridSettings:
     strength: float
     anchor_beat_index: int = 0  # later: downbeat anchor
 
-def build_corrected_grid(analysis: BeatAnalysis, settings: GridSettings):
-    beats = np.array(analysis.beats, dtype=np.float64)
+def build_corrected_grid(analysis: BeatAnalysis, settings: GridSettings) -> np.ndarray:
+    beats = np.asarray(analysis.beats, dtype=np.float64)
 
     seconds_per_beat = 60.0 / float(settings.target_bpm)
     idx = int(np.clip(settings.anchor_beat_index, 0, len(beats) - 1))
     anchor = beats[idx]
 
-    ideal = anchor + np.arange(len(beats)) * seconds_per_beat
-    corrected = beats + float(settings.strength) * (ideal - beats)
-    return corrected.tolist()
+    # corrected = (1 - s) * beats + s * ideal, with ideal = anchor + i * spb,
+    # built in one buffer instead of arange/ideal/(ideal - beats) temporaries
+    strength = float(settings.strength)
+    corrected = np.arange(len(beats), dtype=np.float64)
+    corrected *= seconds_per_beat
+    corrected += anchor
+    corrected *= strength
+    corrected += (1.0 - strength) * beats
+    return corrected
@@ -1,10 +1,11 @@
+import numpy as np
 from dataclasses import dataclass
 from typing import List, Optional
 
 @dataclass
 class BeatAnalysis:
     sample_rate: int
-    beats: List[float]           # seconden
+    beats: np.ndarray            # seconden (float64)
     downbeats: Optional[List[float]]
     bpm_estimate: float
 
@@ -1,10 +1,20 @@
 from __future__ import annotations
 
+import hashlib
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from dataclasses import dataclass
-from typing import List, Optional, Tuple
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Deque, Iterable, Iterator, List, Optional, Tuple, Union
 
 import numpy as np
 import librosa
+import soundfile as sf
 
 try:
     import pyrubberband as pyrb
@@ -18,10 +28,16 @@ class WarpOptions:
     """
     Options for warping audio to a corrected beat grid.
     """
-    engine: str = "auto"            # "auto" | "rubberband" | "librosa"
-    crossfade_ms: int = 10          # 0..20 typical
-    min_seg_ms: int = 40            # very short segments won't be stretched (avoid artifacts)
+    engine: str = "auto"            # "auto" | "rubberband" | "librosa" | "wsola"
+    crossfade_ms: int = 10          # 0..20 typical (per-segment engines only)
+    min_seg_ms: int = 40            # very short segments won't be stretched (per-segment engines only)
     headroom_db: float = 1.0        # normalize to -headroom dBFS peak (simple safety)
+    workers: Optional[int] = None   # segments in flight in the shared pool (None = os.cpu_count(), 1 = serial)
+    segment_cache: bool = True      # reuse stretched segments across runs; rates are rounded to 1e-4 (False = exact)
+
+
+# read(s0, s1) -> float32 frames [s0, s1) with shape (n, ch)
+Reader = Callable[[int, int], np.ndarray]
 
 
 def _to_2d(y: np.ndarray) -> np.ndarray:
@@ -44,115 +60,467 @@ def _choose_engine(engine: str) -> str:
         if not HAS_RUBBERBAND:
             raise RuntimeError("Engine 'rubberband' requested but pyrubberband/rubberband not available.")
         return "rubberband"
-    if engine == "librosa":
-        return "librosa"
-    raise ValueError("engine must be one of: auto, rubberband, librosa")
+    if engine in ("librosa", "wsola"):
+        return engine
+    raise ValueError("engine must be one of: auto, rubberband, librosa, wsola")
 
 
-def _time_stretch_1ch(seg: np.ndarray, sr: int, rate: float, engine: str) -> np.ndarray:
+def _time_stretch_multi(seg: np.ndarray, sr: int, rate: float, engine: str) -> np.ndarray:
     """
-    Stretch a mono segment to new duration by specifying rate = in_len / out_len
+    Stretch a (n, ch) segment to new duration by specifying rate = in_len / out_len
     - rate > 1.0 => speed up (shorter)
     - rate < 1.0 => slow down (longer)
+    All channels are processed in one call, so they always come back with the same length.
+    Module-level so it can be submitted to the worker pool.
     """
     # Avoid pathological rates
     rate = float(np.clip(rate, 0.25, 4.0))
 
-    if engine == "rubberband":
-        # pyrubberband prefers float64
-        out = pyrb.time_stretch(seg.astype(np.float64), sr, rate)
-        return out.astype(np.float32)
+    if engine == "wsola":
+        return _wsola_stretch(seg, sr, rate)
+
+    # librosa phase vocoder: channels-first, STFT is batched over channels
+    out = librosa.effects.time_stretch(seg.T.astype(np.float32), rate=rate)
+    return np.ascontiguousarray(out.T, dtype=np.float32)
+
+
+def _wsola_stretch(seg: np.ndarray, sr: int, rate: float, frame_ms: float = 20.0) -> np.ndarray:
+    """
+    WSOLA (waveform-similarity overlap-add) time stretch of a (n, ch) segment.
+    Pure time domain, no FFT: cheap for short beat segments and keeps transients tight.
+    - synthesis hop Hs = N/2 with a Hann window (sums to 1)
+    - analysis hop Ha = Hs * rate
+    - each frame is shifted within +/- tol to best match the natural
+      continuation of the previous frame (cross-correlation on the mono mix,
+      so all channels use the same offsets)
+    """
+    n, n_ch = seg.shape
+    n_out = int(round(n / rate))
+    N = max(32, int(frame_ms / 1000.0 * sr) // 2 * 2)
+    Hs = N // 2
+    Ha = Hs * rate
+    tol = Hs // 2
+
+    win = (0.5 - 0.5 * np.cos(2.0 * np.pi * np.arange(N) / N)).astype(np.float32)[:, None]
+
+    n_frames = int(np.ceil(n_out / Hs)) + 1
+    pad_end = int(np.ceil((n_frames - 1) * Ha)) + N + 2 * tol + Hs - n
+    x = np.pad(seg, ((tol, max(0, pad_end)), (0, 0)))
+    x_mono = x.mean(axis=1)
+
+    out = np.zeros(((n_frames - 1) * Hs + N, n_ch), dtype=np.float32)
+    wsum = np.zeros(out.shape[0], dtype=np.float32)
+
+    prev = tol  # start of previously used analysis frame (in padded x)
+    for k in range(n_frames):
+        nominal = tol + int(round(k * Ha))
+        if k == 0:
+            pos = nominal
+        else:
+            # natural continuation of the previous frame vs. candidates around nominal
+            template = x_mono[prev + Hs:prev + Hs + N]
+            region = x_mono[nominal - tol:nominal + tol + N]
+            pos = nominal - tol + int(np.argmax(np.correlate(region, template, mode="valid")))
+        o = k * Hs
+        out[o:o + N] += x[pos:pos + N] * win
+        wsum[o:o + N] += win[:, 0]
+        prev = pos
+
+    np.divide(out, np.maximum(wsum, 1e-3)[:, None], out=out)
+    return out[:n_out]
+
+
+def _array_reader(y2d: np.ndarray) -> Reader:
+    return lambda s0, s1: y2d[s0:s1]
+
+
+def _file_reader(f: sf.SoundFile) -> Reader:
+    # segments are requested in order, so this is a forward-only walk through the file
+    def read(s0: int, s1: int) -> np.ndarray:
+        f.seek(s0)
+        return f.read(s1 - s0, dtype="float32", always_2d=True)
+    return read
+
+
+def _timemap_stretch(read: Reader, n_samples: int, sr: int, src: np.ndarray, dst: np.ndarray) -> np.ndarray:
+    """
+    Warp the whole beat range in a single rubberband run, using a time map
+    (source sample -> target sample at every beat) instead of one
+    rubberband process per beat segment. Rubberband varies the ratio
+    smoothly itself, so no segment crossfades are needed.
+    """
+    s = np.clip(np.round(src * sr).astype(np.int64), 0, n_samples)
+    d = np.round((dst - dst[0]) * sr).astype(np.int64)
 
-    # librosa phase vocoder
-    out = librosa.effects.time_stretch(seg.astype(np.float32), rate=rate)
-    return out.astype(np.float32)
+    # rounding/clipping can collapse neighbouring beats onto the same sample
+    keep = np.concatenate([[True], (np.diff(s) > 0) & (np.diff(d) > 0)])
+    s, d = s[keep], d[keep]
+    if len(s) < 2:
+        raise RuntimeError("Beat grid lies outside the audio.")
+
+    seg = read(int(s[0]), int(s[-1]))
+    time_map = list(zip((s - s[0]).tolist(), (d - d[0]).tolist()))
+
+    # float32 in, float32 out: pyrubberband round-trips through a 16-bit WAV, so a
+    # float64 copy buys nothing. Only pyrubberband >= 0.4 reads back in the input
+    # dtype (older releases return float64), hence the cast (a no-op on 0.4).
+    out = pyrb.timemap_stretch(seg, sr, time_map)
+    return out.astype(np.float32, copy=False).reshape(-1, seg.shape[1])
+
+
+@lru_cache(maxsize=8)
+def _fade_windows(cf: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fade-in/out ramps of cf samples, shape (cf, 1). Built once per length
+    and shared, so they are marked read-only.
+    """
+    fade_in = np.linspace(0.0, 1.0, cf, dtype=np.float32)[:, None]
+    fade_out = np.linspace(1.0, 0.0, cf, dtype=np.float32)[:, None]
+    fade_in.flags.writeable = False
+    fade_out.flags.writeable = False
+    return fade_in, fade_out
 
 
 def _apply_fades(seg2d: np.ndarray, cf: int) -> np.ndarray:
     """
     Apply fade-in/out windows to segment edges to reduce clicks.
+    Works in place: segments come from our own float32 copy, a fresh file read or a fresh stretch.
     seg2d shape: (n, ch)
     """
     n = seg2d.shape[0]
     if cf <= 0 or n < 2 * cf + 8:
         return seg2d
 
-    fade_in = np.linspace(0.0, 1.0, cf, dtype=np.float32)[:, None]
-    fade_out = np.linspace(1.0, 0.0, cf, dtype=np.float32)[:, None]
-
-    seg2d = seg2d.copy()
-    seg2d[:cf] *= fade_in
-    seg2d[-cf:] *= fade_out
+    fade_in, fade_out = _fade_windows(cf)
+    np.multiply(seg2d[:cf], fade_in, out=seg2d[:cf])
+    np.multiply(seg2d[-cf:], fade_out, out=seg2d[-cf:])
     return seg2d
 
 
-def _overlap_add(out: np.ndarray, seg: np.ndarray, cf: int) -> np.ndarray:
+def _overlap_add(segments: Iterable[np.ndarray], cf: int, write: Callable[[np.ndarray], None]) -> float:
+    """
+    Fade + overlap-add segments in order, handing finished output blocks to write().
+    Only the last cf samples are held back (the next segment overlaps them).
+    The peak is measured per finished block, while it is still hot in cache.
+    Returns the peak of everything written.
+    """
+    peak = 0.0
+    tail = None
+    for seg2 in segments:
+        seg2 = _apply_fades(seg2, cf)
+        if tail is None or tail.shape[0] == 0:
+            pending = seg2
+        elif tail.shape[0] >= cf and seg2.shape[0] >= cf:
+            # overlap region
+            seg2[:cf] += tail
+            pending = seg2
+        else:
+            pending = np.concatenate([tail, seg2])
+
+        n_final = max(0, pending.shape[0] - cf)
+        if n_final:
+            peak = max(peak, _peak(pending[:n_final]))
+            write(pending[:n_final])
+        tail = pending[n_final:]
+
+    if tail is not None and tail.shape[0]:
+        peak = max(peak, _peak(tail))
+        write(tail)
+    return peak
+
+
+class _ArraySink:
     """
-    Overlap-add two segments with pre-applied fades.
-    out, seg shapes: (n, ch)
+    Output buffer allocated once from the planned length; grows only if an
+    engine returns more samples than planned.
     """
-    if cf <= 0 or out.shape[0] < cf or seg.shape[0] < cf:
-        return np.vstack([out, seg])
 
-    # overlap region
-    out_tail = out[-cf:]
-    seg_head = seg[:cf]
-    out[-cf:] = out_tail + seg_head
-    return np.vstack([out, seg[cf:]])
+    def __init__(self, n: int, n_ch: int):
+        self.buf = np.empty((n, n_ch), dtype=np.float32)
+        self.pos = 0
+
+    def write(self, block: np.ndarray):
+        end = self.pos + block.shape[0]
+        if end > self.buf.shape[0]:
+            grown = np.empty((max(end, 2 * self.buf.shape[0]), self.buf.shape[1]), dtype=np.float32)
+            grown[:self.pos] = self.buf[:self.pos]
+            self.buf = grown
+        self.buf[self.pos:end] = block
+        self.pos = end
+
+    def result(self) -> np.ndarray:
+        return self.buf[:self.pos]
+
+
+def _peak(y2d: np.ndarray) -> float:
+    return float(np.max(np.abs(y2d))) if y2d.size else 0.0
+
+
+def _peak_gain(peak: float, headroom_db: Optional[float]) -> float:
+    """
+    Gain that brings peak down to -headroom dBFS (never boosts).
+    """
+    if headroom_db is None or peak <= 0.0:
+        return 1.0
+    target = 10 ** (-float(headroom_db) / 20.0)  # e.g. -1 dB => 0.891
+    return target / peak if peak > target else 1.0
 
 
-def _normalize_peak(y2d: np.ndarray, headroom_db: float) -> np.ndarray:
+def _normalize_peak(y2d: np.ndarray, headroom_db: float, peak: Optional[float] = None) -> np.ndarray:
     """
-    Simple peak normalization to -headroom dBFS.
+    Simple peak normalization to -headroom dBFS, in place.
+    Pass peak if it is already known (tracked while writing) to skip the extra scan.
     This is NOT a true-peak limiter, but helps avoid clipping after processing.
     """
     if headroom_db is None:
         return y2d
 
-    peak = float(np.max(np.abs(y2d))) if y2d.size else 0.0
-    if peak <= 0.0:
-        return y2d
-
-    target = 10 ** (-float(headroom_db) / 20.0)  # e.g. -1 dB => 0.891
-    if peak > target:
-        y2d = y2d * (target / peak)
+    if peak is None:
+        peak = _peak(y2d)
+    gain = _peak_gain(peak, headroom_db)
+    if gain != 1.0:
+        np.multiply(y2d, gain, out=y2d)
     return y2d
 
 
-def warp_to_grid(
-    y: np.ndarray,
+@dataclass
+class _SegmentPlan:
+    """
+    Per beat interval, computed once as arrays: sample bounds [start, end),
+    clipped stretch rate, and whether the segment is long enough to stretch.
+    Empty intervals are already dropped.
+    """
+    starts: np.ndarray
+    ends: np.ndarray
+    rates: np.ndarray
+    stretch: np.ndarray
+
+    def __iter__(self) -> Iterator[Tuple[int, int, Optional[float]]]:
+        # (s0, s1, rate) as Python scalars; rate is None for unstretched segments
+        for s0, s1, rate, st in zip(self.starts.tolist(), self.ends.tolist(), self.rates.tolist(), self.stretch.tolist()):
+            yield s0, s1, (rate if st else None)
+
+    @property
+    def n_jobs(self) -> int:
+        return int(np.count_nonzero(self.stretch))
+
+    def output_length(self) -> int:
+        # librosa and wsola both return exactly round(n / rate) samples
+        n = self.ends - self.starts
+        return int(np.where(self.stretch, np.round(n / self.rates), n).sum())
+
+
+def _segment_plan(
+    src: np.ndarray,
+    dst: np.ndarray,
     sr: int,
-    src_beats: List[float],
-    dst_beats: List[float],
-    options: Optional[WarpOptions] = None,
-) -> np.ndarray:
+    n_samples: int,
+    min_seg: int,
+    rate_decimals: Optional[int] = None,
+) -> _SegmentPlan:
     """
-    Warp audio so that beats at src_beats map to dst_beats.
-    - Preserves pitch (time-stretch)
-    - Piecewise per-beat segment
-    - Stereo-safe: same timing for all channels
+    Vectorized bounds/rates for every interval [beat_i, beat_{i+1}].
+    rate_decimals rounds the rates (used with the segment cache); None keeps them exact.
+    """
+    in_durs = np.maximum(1e-6, np.diff(src))
+    out_durs = np.maximum(1e-6, np.diff(dst))
+    # We want seg duration -> out_dur; define rate as in_len / out_len (pathological rates are clipped).
+    rates = np.clip(in_durs / out_durs, 0.25, 4.0)
+    if rate_decimals is not None:
+        rates = np.round(rates, rate_decimals)
 
-    Parameters
-    ----------
-    y : np.ndarray
-        Audio samples. Shape (n,) or (n, ch). dtype float recommended (-1..1).
-    sr : int
-        Sample rate.
-    src_beats : List[float]
-        Original beat times in seconds.
-    dst_beats : List[float]
-        Target beat times in seconds (same length as src_beats).
-    options : WarpOptions
-        Engine/crossfade/headroom settings.
+    bounds = np.clip(np.round(src * sr).astype(np.int64), 0, n_samples)
+    starts, ends = bounds[:-1], bounds[1:]
 
-    Returns
-    -------
-    np.ndarray
-        Warped audio with shape (n, ch) if input was 2D, or (n,) if input was mono.
+    valid = ends > starts
+    starts, ends, rates = starts[valid], ends[valid], rates[valid]
+    # If segment is too short, skip stretching to avoid garbage artifacts
+    return _SegmentPlan(starts, ends, rates, (ends - starts) >= min_seg)
+
+
+SEGMENT_CACHE_BYTES = 256 * 1024 * 1024
+# With the cache on, segments are stretched at rates rounded to this many decimals, so the
+# cache key is the rate that was actually used. Exact rates almost never repeat: a strength
+# tweak moves every one, and even anchor re-clicks differ in the last float bits. The cost is
+# a duration error of at most 0.005% per beat (~1 sample on a 0.5 s beat at 44.1 kHz);
+# segment_cache=False stretches at the exact rates.
+SEGMENT_CACHE_RATE_DECIMALS = 4
+
+
+class _SegmentCache:
     """
-    if options is None:
-        options = WarpOptions()
+    LRU of stretched segments, bounded by total array bytes and shared by
+    all warps in this process (the API re-runs the same song with small
+    parameter changes). Keyed by a digest of the input samples plus the
+    (rounded) rate/shape/sr/engine. Values are copied in and out, because fades and
+    overlap-add modify segments in place.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(seg: np.ndarray, sr: int, rate: float, engine: str) -> tuple:
+        digest = hashlib.blake2b(np.ascontiguousarray(seg).data, digest_size=16).digest()
+        return digest, rate, seg.shape, sr, engine
+
+    def get(self, key: tuple) -> Optional[np.ndarray]:
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                return None
+            self._items.move_to_end(key)
+        return value.copy()
+
+    def put(self, key: tuple, value: np.ndarray):
+        if value.nbytes > self.max_bytes:
+            return
+        value = value.copy()
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self._items[key] = value
+            self.nbytes += value.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+
+_SEGMENT_CACHE = _SegmentCache(SEGMENT_CACHE_BYTES)
+
+
+# One process pool for all warps in this process, created on first use and
+# reused: fresh workers pay librosa's first-call cost, and concurrent API
+# requests must not each start os.cpu_count() processes. "spawn" because the
+# API submits from threadpool threads, and forking a threaded process can deadlock.
+_POOL: Optional[ProcessPoolExecutor] = None
+_POOL_LOCK = threading.Lock()
+
+
+def _warm_worker():
+    # runs once per worker process, before its first segment
+    librosa.effects.time_stretch(np.zeros(4096, dtype=np.float32), rate=1.1)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 1,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_warm_worker,
+            )
+        return _POOL
+
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    # a dead worker (OOM kill, segfault) breaks the executor for good: drop it so the next call builds a fresh one
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is pool:
+            _POOL = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _iter_stretched(
+    read: Reader,
+    plan: _SegmentPlan,
+    sr: int,
+    engine: str,
+    workers: Optional[int],
+    use_cache: bool = True,
+) -> Iterator[np.ndarray]:
+    """
+    Read + stretch planned segments, yielding them in order.
+    With workers > 1 the stretches run in the shared process pool; only a bounded
+    window of segments is read ahead, so file input is never fully in memory.
+    Cached stretches are served without touching the pool. If a worker dies
+    this call fails with BrokenProcessPool and the pool is rebuilt on the next call.
+    """
+    cache = _SEGMENT_CACHE if use_cache else None
+    workers = workers or os.cpu_count() or 1
+    pool = None if workers <= 1 or plan.n_jobs <= 1 else _get_pool()
+    lookahead = 4 * workers if pool else 1
+
+    # (segment or future, cache key to store the result under)
+    window: Deque[Tuple[Union[np.ndarray, Future], Optional[tuple]]] = deque()
+    try:
+        for s0, s1, rate in plan:
+            seg = read(s0, s1)
+            key = None
+            if rate is None:
+                item = seg
+            else:
+                key = _SegmentCache.key(seg, sr, rate, engine) if cache else None
+                item = cache.get(key) if cache else None
+                if item is not None:
+                    key = None  # hit: nothing to store
+                elif pool is None:
+                    item = _time_stretch_multi(seg, sr, rate, engine)
+                else:
+                    item = pool.submit(_time_stretch_multi, seg, sr, rate, engine)
+            window.append((item, key))
+            if len(window) >= lookahead:
+                yield _collect(*window.popleft(), cache)
+        while window:
+            yield _collect(*window.popleft(), cache)
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        raise
+    finally:
+        # the pool is shared: on early exit only drop this call's pending work
+        for item, _ in window:
+            if isinstance(item, Future):
+                item.cancel()
+
+
+def _collect(item: Union[np.ndarray, Future], key: Optional[tuple], cache: Optional[_SegmentCache]) -> np.ndarray:
+    # unstretched segments and cache hits are queued as-is, stretches as futures
+    if isinstance(item, Future):
+        item = item.result()
+    if key is not None:
+        cache.put(key, item)
+    return item
+
+
+def _warp_segments(
+    read: Reader,
+    n_samples: int,
+    n_ch: int,
+    sr: int,
+    src: np.ndarray,
+    dst: np.ndarray,
+    cf: int,
+    min_seg: int,
+    engine: str,
+    workers: Optional[int],
+    use_cache: bool = True,
+) -> Tuple[np.ndarray, float]:
+    """
+    Piecewise warp: stretch every beat interval separately (in parallel
+    worker processes), then fade + overlap-add them back together.
+    Returns the warped audio and its peak.
+    """
+    plan = _segment_plan(src, dst, sr, n_samples, min_seg, SEGMENT_CACHE_RATE_DECIMALS if use_cache else None)
+    sink = _ArraySink(plan.output_length(), n_ch)
+    peak = _overlap_add(_iter_stretched(read, plan, sr, engine, workers, use_cache), cf, sink.write)
+    return sink.result(), peak
 
+
+def _prepare(
+    src_beats: Union[np.ndarray, List[float]],
+    dst_beats: Union[np.ndarray, List[float]],
+    sr: int,
+    options: WarpOptions,
+) -> Tuple[str, np.ndarray, np.ndarray, int, int]:
+    """
+    Validate inputs; returns (engine, src, dst, crossfade samples, min segment samples).
+    """
     engine = _choose_engine(options.engine)
 
     if len(src_beats) != len(dst_beats):
@@ -160,78 +528,130 @@ def warp_to_grid(
     if len(src_beats) < 4:
         raise ValueError("Need at least 4 beats to warp reliably.")
 
-    y2d = _to_2d(y).astype(np.float32)
-    n_samples, n_ch = y2d.shape
-
     # Crossfade length in samples
     cf = int(max(0, options.crossfade_ms) / 1000.0 * sr)
     cf = int(np.clip(cf, 0, int(0.02 * sr)))  # max 20ms
 
     min_seg = int(max(1, options.min_seg_ms) / 1000.0 * sr)
 
-    src = np.array(src_beats, dtype=np.float64)
-    dst = np.array(dst_beats, dtype=np.float64)
+    src = np.asarray(src_beats, dtype=np.float64)
+    dst = np.asarray(dst_beats, dtype=np.float64)
 
     # Ensure strictly increasing (beat trackers sometimes duplicate)
     # We drop non-increasing beats to avoid negative/zero segments.
-    keep = np.ones(len(src), dtype=bool)
-    for i in range(1, len(src)):
-        if src[i] <= src[i - 1] + 1e-6 or dst[i] <= dst[i - 1] + 1e-6:
-            keep[i] = False
+    keep = np.concatenate([[True], (np.diff(src) > 1e-6) & (np.diff(dst) > 1e-6)])
 
     src = src[keep]
     dst = dst[keep]
     if len(src) < 4:
         raise RuntimeError("Too many invalid/non-increasing beats after cleaning.")
 
-    out = np.zeros((0, n_ch), dtype=np.float32)
-
-    # Process each interval [beat_i, beat_{i+1}]
-    for i in range(len(src) - 1):
-        a0, a1 = float(src[i]), float(src[i + 1])
-        b0, b1 = float(dst[i]), float(dst[i + 1])
-
-        in_dur = max(1e-6, a1 - a0)
-        out_dur = max(1e-6, b1 - b0)
+    return engine, src, dst, cf, min_seg
 
-        s0 = int(round(a0 * sr))
-        s1 = int(round(a1 * sr))
-        s0 = int(np.clip(s0, 0, n_samples))
-        s1 = int(np.clip(s1, 0, n_samples))
 
-        if s1 <= s0:
-            continue
+def warp_to_grid(
+    y: np.ndarray,
+    sr: int,
+    src_beats: Union[np.ndarray, List[float]],
+    dst_beats: Union[np.ndarray, List[float]],
+    options: Optional[WarpOptions] = None,
+) -> np.ndarray:
+    """
+    Warp audio so that beats at src_beats map to dst_beats.
+    - Preserves pitch (time-stretch)
+    - rubberband: one run driven by a beat time map; librosa/wsola: piecewise per-beat segment
+    - Stereo-safe: same timing for all channels
 
-        seg = y2d[s0:s1]  # (nseg, ch)
+    Parameters
+    ----------
+    y : np.ndarray
+        Audio samples. Shape (n,) or (n, ch). dtype float recommended (-1..1).
+    sr : int
+        Sample rate.
+    src_beats : np.ndarray or List[float]
+        Original beat times in seconds.
+    dst_beats : np.ndarray or List[float]
+        Target beat times in seconds (same length as src_beats).
+        float64 arrays are used as-is (no copy).
+    options : WarpOptions
+        Engine/crossfade/headroom settings.
 
-        # If segment is too short, skip stretching to avoid garbage artifacts
-        if seg.shape[0] < min_seg:
-            seg2 = seg
-        else:
-            # We want seg duration -> out_dur
-            # Define rate as in_len / out_len
-            rate = in_dur / out_dur
+    Returns
+    -------
+    np.ndarray
+        Warped audio with shape (n, ch) if input was 2D, or (n,) if input was mono.
+    """
+    if options is None:
+        options = WarpOptions()
 
-            # Stretch each channel with the same rate
-            stretched_channels = []
-            for ch in range(n_ch):
-                stretched = _time_stretch_1ch(seg[:, ch], sr, rate, engine)
-                stretched_channels.append(stretched)
+    engine, src, dst, cf, min_seg = _prepare(src_beats, dst_beats, sr, options)
 
-            # Align channels to same length (engine may produce +/-1 samples diff)
-            min_len = min(map(len, stretched_channels))
-            seg2 = np.stack([c[:min_len] for c in stretched_channels], axis=1)
+    y2d = _to_2d(y).astype(np.float32)
+    n_samples, n_ch = y2d.shape
+    read = _array_reader(y2d)
 
-        # Edge fades + overlap-add
-        seg2 = _apply_fades(seg2, cf)
-        if out.shape[0] == 0:
-            out = seg2
-        else:
-            out = _overlap_add(out, seg2, cf)
+    if engine == "rubberband":
+        out, peak = _timemap_stretch(read, n_samples, sr, src, dst), None
+    else:
+        out, peak = _warp_segments(
+            read, n_samples, n_ch, sr, src, dst, cf, min_seg, engine, options.workers, options.segment_cache
+        )
 
-    out = _normalize_peak(out, options.headroom_db)
+    out = _normalize_peak(out, options.headroom_db, peak)
 
     # Return in original dimensionality
     if y.ndim == 1:
         return out[:, 0]
     return out
+
+
+def warp_file_to_grid(
+    in_path: str,
+    out_path: str,
+    src_beats: Union[np.ndarray, List[float]],
+    dst_beats: Union[np.ndarray, List[float]],
+    options: Optional[WarpOptions] = None,
+    subtype: str = "PCM_16",
+) -> None:
+    """
+    File-to-file variant of warp_to_grid for long tracks.
+
+    librosa/wsola: beat segments are read on demand (seek + read) and the
+    overlap-added output is streamed to a float32 scratch file next to
+    out_path, so neither the input nor the output is held in memory. The
+    peak gain is applied in a final block-wise pass that writes out_path.
+
+    rubberband: pyrubberband works on arrays, so the beat range is read in
+    one go and the result written directly.
+    """
+    if options is None:
+        options = WarpOptions()
+
+    with sf.SoundFile(str(in_path)) as f:
+        sr, n_samples, n_ch = f.samplerate, f.frames, f.channels
+        engine, src, dst, cf, min_seg = _prepare(src_beats, dst_beats, sr, options)
+        read = _file_reader(f)
+
+        if engine == "rubberband":
+            out = _normalize_peak(_timemap_stretch(read, n_samples, sr, src, dst), options.headroom_db)
+            sf.write(str(out_path), out, sr, subtype=subtype)
+            return
+
+        plan = _segment_plan(
+            src, dst, sr, n_samples, min_seg, SEGMENT_CACHE_RATE_DECIMALS if options.segment_cache else None
+        )
+        scratch = Path(str(out_path) + ".part")
+        try:
+            with sf.SoundFile(str(scratch), "w", samplerate=sr, channels=n_ch, format="WAV", subtype="FLOAT") as tmp:
+                segments = _iter_stretched(read, plan, sr, engine, options.workers, options.segment_cache)
+                peak = _overlap_add(segments, cf, tmp.write)
+
+            gain = _peak_gain(peak, options.headroom_db)
+            with sf.SoundFile(str(scratch)) as tmp, \
+                    sf.SoundFile(str(out_path), "w", samplerate=sr, channels=n_ch, subtype=subtype) as dst_f:
+                for block in tmp.blocks(blocksize=1 << 16, dtype="float32", always_2d=True):
+                    if gain != 1.0:
+                        np.multiply(block, gain, out=block)
+                    dst_f.write(block)
+        finally:
+            scratch.unlink(missing_ok=True)
@@ -39,7 +39,7 @@ def main():
     p.add_argument("--bpm", type=float, default=None, help="Target BPM (default: rounded estimate)")
     p.add_argument("--strength", type=float, default=0.7, help="0.0..1.0 (default 0.7)")
     p.add_argument("--crossfade-ms", type=int, default=10, help="Crossfade in ms (default 10)")
-    p.add_argument("--engine", choices=["auto", "rubberband", "librosa"], default="auto")
+    p.add_argument("--engine", choices=["auto", "rubberband", "librosa", "wsola"], default="auto")
     p.add_argument("--out", default=None, help="Output wav path (default: <name>_straight.wav)")
     args = p.parse_args()
 